@@ -15,7 +15,11 @@ def create_dataloaders(
     test_dir: str, 
     transform: transforms.Compose, 
     batch_size: int, 
-    num_workers: int=NUM_WORKERS
+    num_workers: int=NUM_WORKERS,
+    pin_memory: bool=True,
+    persistent_workers: bool=False,
+    prefetch_factor: int=None,
+    drop_last: bool=False
 ):
 
     """
@@ -30,6 +34,14 @@ def create_dataloaders(
         transform: torchvision transforms to perform on training and testing data.
         batch_size: Number of samples per batch in each of the DataLoaders.
         num_workers: An integer for number of workers per DataLoader.
+        pin_memory: Whether to copy batches into page-locked memory, enabling
+            asynchronous (non_blocking) host to GPU transfers.
+        persistent_workers: Whether to keep the worker processes alive between
+            epochs. Ignored when num_workers is 0.
+        prefetch_factor: Number of batches loaded in advance by each worker.
+            Ignored when num_workers is 0.
+        drop_last: Whether to drop the last incomplete batch of the training
+            DataLoader, so every training batch has the same shape.
 
     Returns:
         A tuple of (train_dataloader, test_dataloader, class_names).
@@ -50,20 +62,29 @@ def create_dataloaders(
     # Get class names
     class_names = train_data.classes
 
+    # Worker options are only accepted by DataLoader when using subprocesses
+    worker_kwargs = {}
+    if num_workers > 0:
+        worker_kwargs["persistent_workers"] = persistent_workers
+        worker_kwargs["prefetch_factor"] = prefetch_factor
+
     # Turn images into data loaders
     train_dataloader = DataLoader(
         train_data,
         batch_size=batch_size,
         shuffle=True,
         num_workers=num_workers,
-        pin_memory=True,
+        pin_memory=pin_memory,
+        drop_last=drop_last,
+        **worker_kwargs,
     )
     test_dataloader = DataLoader(
         test_data,
         batch_size=batch_size,
         shuffle=False,
         num_workers=num_workers,
-        pin_memory=True,
+        pin_memory=pin_memory,
+        **worker_kwargs,
     )
 
     return train_dataloader, test_dataloader, class_names
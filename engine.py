@@ -2,14 +2,17 @@
 Contains functions for training and testing a PyTorch model.
 """
 import torch
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 def train_step(
     model: torch.nn.Module, 
     dataloader: torch.utils.data.DataLoader, 
     loss_fn: torch.nn.Module, 
     optimizer: torch.optim.Optimizer,
-    device: torch.device
+    device: torch.device,
+    channels_last: bool = False,
+    amp_dtype: Optional[torch.dtype] = None,
+    scaler: Optional[torch.amp.GradScaler] = None
 ) -> Tuple[float, float]:
     """Trains a PyTorch model for a single epoch.
 
@@ -23,6 +26,12 @@ def train_step(
         loss_fn: A PyTorch loss function to minimize.
         optimizer: A PyTorch optimizer to help minimize the loss function.
         device: A target device to compute on (e.g. "cuda" or "cpu").
+        channels_last: (optional) Whether to send input batches in the
+            torch.channels_last (NHWC) memory format.
+        amp_dtype: (optional) A reduced precision dtype (e.g. torch.float16)
+            to run the forward pass and loss under autocast with.
+        scaler: (optional) A GradScaler used to scale the loss before the
+            backward pass when training in FP16.
 
     Returns:
         A tuple of training loss and training accuracy metrics.
@@ -32,6 +41,7 @@ def train_step(
     """
     # Put model in train mode
     model.train()
+    device_type = torch.device(device).type
 
     # Setup train loss and train accuracy values
     train_loss, train_acc = 0, 0
@@ -39,23 +49,34 @@ def train_step(
     # Loop through data loader data batches
     for batch, (X, y) in enumerate(dataloader):
         # Send data to target device
-        X, y = X.to(device), y.to(device)
+        X, y = X.to(device, non_blocking=True), y.to(device, non_blocking=True)
+        if channels_last:
+            X = X.contiguous(memory_format=torch.channels_last)
 
-        # 1. Forward pass
-        y_pred = model(X)
+        with torch.autocast(device_type=device_type, dtype=amp_dtype, enabled=amp_dtype is not None):
+            # 1. Forward pass
+            y_pred = model(X)
 
-        # 2. Calculate  and accumulate loss
-        loss = loss_fn(y_pred, y)
+            # 2. Calculate  and accumulate loss
+            loss = loss_fn(y_pred, y)
         train_loss += loss.item() 
 
-        # 3. Optimizer zero grad
-        optimizer.zero_grad()
+        # 3. Optimizer zero grad, releasing the gradients instead of filling them with zeros
+        optimizer.zero_grad(set_to_none=True)
+
+        if scaler is not None:
+            # 4. Scaled loss backward
+            scaler.scale(loss).backward()
 
-        # 4. Loss backward
-        loss.backward()
+            # 5. Optimizer step, skipped if the gradients overflowed
+            scaler.step(optimizer)
+            scaler.update()
+        else:
+            # 4. Loss backward
+            loss.backward()
 
-        # 5. Optimizer step
-        optimizer.step()
+            # 5. Optimizer step
+            optimizer.step()
 
         # Calculate and accumulate accuracy metric across all batches
         y_pred_class = torch.argmax(torch.softmax(y_pred, dim=1), dim=1)
@@ -74,7 +95,9 @@ def test_step(
     model: torch.nn.Module, 
     dataloader: torch.utils.data.DataLoader, 
     loss_fn: torch.nn.Module,
-    device: torch.device
+    device: torch.device,
+    channels_last: bool = False,
+    amp_dtype: Optional[torch.dtype] = None
 ) -> Tuple[float, float]:
     """
     Tests a PyTorch model for a single epoch.
@@ -87,6 +110,10 @@ def test_step(
         dataloader: A DataLoader instance for the model to be tested on.
         loss_fn: A PyTorch loss function to calculate loss on the test data.
         device: A target device to compute on (e.g. "cuda" or "cpu").
+        channels_last: (optional) Whether to send input batches in the
+            torch.channels_last (NHWC) memory format.
+        amp_dtype: (optional) A reduced precision dtype (e.g. torch.float16)
+            to run the forward pass and loss under autocast with.
 
     Returns:
         A tuple of testing loss and testing accuracy metrics.
@@ -96,6 +123,7 @@ def test_step(
     """
     # Put model in eval mode
     model.eval() 
+    device_type = torch.device(device).type
 
     # Setup test loss and test accuracy values
     test_loss, test_acc = 0, 0
@@ -105,13 +133,16 @@ def test_step(
         # Loop through DataLoader batches
         for batch, (X, y) in enumerate(dataloader):
             # Send data to target device
-            X, y = X.to(device), y.to(device)
+            X, y = X.to(device, non_blocking=True), y.to(device, non_blocking=True)
+            if channels_last:
+                X = X.contiguous(memory_format=torch.channels_last)
 
-            # 1. Forward pass
-            test_pred_logits = model(X)
+            with torch.autocast(device_type=device_type, dtype=amp_dtype, enabled=amp_dtype is not None):
+                # 1. Forward pass
+                test_pred_logits = model(X)
 
-            # 2. Calculate and accumulate loss
-            loss = loss_fn(test_pred_logits, y)
+                # 2. Calculate and accumulate loss
+                loss = loss_fn(test_pred_logits, y)
             test_loss += loss.item()
 
             # Calculate and accumulate accuracy
@@ -135,7 +166,10 @@ def train(
     loss_fn: torch.nn.Module,
     epochs: int,
     device: torch.device,
-    results = None
+    results = None,
+    channels_last: bool = False,
+    amp_dtype: Optional[torch.dtype] = None,
+    scaler: Optional[torch.amp.GradScaler] = None
 ) -> Dict[str, List]:
     """Trains and tests a PyTorch model.
 
@@ -160,6 +194,12 @@ def train(
                             train_acc: [...],
                             test_loss: [...],
                             test_acc: [...]} 
+        channels_last: (optional) Whether to send input batches in the
+            torch.channels_last (NHWC) memory format.
+        amp_dtype: (optional) A reduced precision dtype (e.g. torch.float16)
+            to run the forward pass and loss under autocast with.
+        scaler: (optional) A GradScaler used to scale the loss before the
+            backward pass when training in FP16.
 
     Returns:
         A dictionary of training and testing loss as well as training and
@@ -195,13 +235,18 @@ def train(
             dataloader=train_dataloader,
             loss_fn=loss_fn,
             optimizer=optimizer,
-            device=device
+            device=device,
+            channels_last=channels_last,
+            amp_dtype=amp_dtype,
+            scaler=scaler
         )
         test_loss, test_acc = test_step(
             model=model,
             dataloader=test_dataloader,
             loss_fn=loss_fn,
-            device=device
+            device=device,
+            channels_last=channels_last,
+            amp_dtype=amp_dtype
         )
 
         # Print out what's happening
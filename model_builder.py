@@ -4,6 +4,7 @@ Contains PyTorch model code to instantiate a CNN models.
 import torch
 from torch import nn
 import torch.nn.functional as F
+import torch.utils.checkpoint
 import math
 from collections import OrderedDict
 
@@ -14,6 +15,7 @@ class VGG19(nn.Module):
     Creates the VGG19 architecture.
 
     Replicates the VGG19, the a convolutional neural network introduced by Karen Simonyan, that consists of 19 layers, 16 convolution layers, and three fully connected layers.
+    The three fully connected layers are replaced here by global average pooling and a single linear layer, as in ResNet18, which drops ~120M parameters from the classifier.
     Original Resource : https://arxiv.org/abs/1409.1556 
 
     Args:
@@ -21,131 +23,119 @@ class VGG19(nn.Module):
     kernel_size: An integer indicating number N for N x N shaped kernel box.
     padding: An integer indicating number of hidden outer values for each layer.
     padding: An integer indicating number of steps skipped for each iteration for kernel.
+    checkpoint: A boolean indicating whether to recompute the first three stages in the backward pass instead of storing their activations.
     """
-    def __init__(self, num_classes=10, kernel_size=3, padding=1, stride=1):
+    def __init__(self, num_classes=10, kernel_size=3, padding=1, stride=1, checkpoint=True):
         super(VGG19, self).__init__()
-        self.conv_1_1 = nn.Sequential(
-            nn.Conv2d(3, 64, kernel_size=kernel_size, stride=stride, padding=padding),
-            nn.BatchNorm2d(64),
-            nn.ReLU()
-        )
-        self.conv_1_2 = nn.Sequential(
-            nn.Conv2d(64, 64, kernel_size=kernel_size, stride=stride, padding=padding),
-            nn.BatchNorm2d(64),
-            nn.ReLU()
-        )
-        self.conv_2_1 = nn.Sequential(
-            nn.Conv2d(64, 128, kernel_size=kernel_size, stride=stride, padding=padding),
-            nn.BatchNorm2d(128),
-            nn.ReLU()
-        )
-        self.conv_2_2 = nn.Sequential(
-            nn.Conv2d(128, 128, kernel_size=kernel_size, stride=stride, padding=padding),
-            nn.BatchNorm2d(128),
-            nn.ReLU()
-        )
-        self.conv_3_1 = nn.Sequential(
-            nn.Conv2d(128, 256, kernel_size=kernel_size, stride=stride, padding=padding),
-            nn.BatchNorm2d(256),
-            nn.ReLU()
-        )
-        self.conv_3_2 = nn.Sequential(
-            nn.Conv2d(256, 256, kernel_size=kernel_size, stride=stride, padding=padding),
-            nn.BatchNorm2d(256),
-            nn.ReLU()
-        )
-        self.conv_3_3 = nn.Sequential(
-            nn.Conv2d(256, 256, kernel_size=kernel_size, stride=stride, padding=padding),
-            nn.BatchNorm2d(256),
-            nn.ReLU()
-        )
-        self.conv_3_4 = nn.Sequential(
-            nn.Conv2d(256, 256, kernel_size=kernel_size, stride=stride, padding=padding),
-            nn.BatchNorm2d(256),
-            nn.ReLU()
-        )
-        self.conv_4_1 = nn.Sequential(
-            nn.Conv2d(256, 512, kernel_size=kernel_size, stride=stride, padding=padding),
-            nn.BatchNorm2d(512),
-            nn.ReLU()
-        )
-        self.conv_4_2 = nn.Sequential(
-            nn.Conv2d(512, 512, kernel_size=kernel_size, stride=stride, padding=padding),
-            nn.BatchNorm2d(512),
-            nn.ReLU()
-        )
-        self.conv_4_3 = nn.Sequential(
-            nn.Conv2d(512, 512, kernel_size=kernel_size, stride=stride, padding=padding),
-            nn.BatchNorm2d(512),
-            nn.ReLU()
-        )
-        self.conv_4_4 = nn.Sequential(
-            nn.Conv2d(512, 512, kernel_size=kernel_size, stride=stride, padding=padding),
-            nn.BatchNorm2d(512),
-            nn.ReLU()
-        )
-        self.conv_5_1 = nn.Sequential(
-            nn.Conv2d(512, 512, kernel_size=kernel_size, stride=stride, padding=padding),
-            nn.BatchNorm2d(512),
-            nn.ReLU()
-        )
-        self.conv_5_2 = nn.Sequential(
-            nn.Conv2d(512, 512, kernel_size=kernel_size, stride=stride, padding=padding),
-            nn.BatchNorm2d(512),
-            nn.ReLU()
-        )
-        self.conv_5_3 = nn.Sequential(
-            nn.Conv2d(512, 512, kernel_size=kernel_size, stride=stride, padding=padding),
-            nn.BatchNorm2d(512),
-            nn.ReLU()
-        )
-        self.conv_5_4 = nn.Sequential(
-            nn.Conv2d(512, 512, kernel_size=kernel_size, stride=stride, padding=padding),
-            nn.BatchNorm2d(512),
-            nn.ReLU()
-        )
-        self.fc = nn.Sequential(
-            nn.Dropout(0.5),
-            nn.Linear(7*7*512, 4096),
-            nn.ReLU()
-        )
-        self.fc1 = nn.Sequential(
-            nn.Dropout(0.5),
-            nn.Linear(4096, 4096),
+        self.kernel_size = kernel_size
+        self.padding = padding
+        self.stride = stride
+        self.checkpoint = checkpoint
+
+        self.pool = nn.MaxPool2d(kernel_size = 2, stride = 2)
+
+        # Each stage ends with a pooling layer, so only its output is kept alive for the next one
+        self.stage1 = nn.Sequential(
+            self.conv_bn(3, 64),
+            self.conv_bn(64, 64),
+            self.pool
+        )
+        self.stage2 = nn.Sequential(
+            self.conv_bn(64, 128),
+            self.conv_bn(128, 128),
+            self.pool
+        )
+        self.stage3 = nn.Sequential(
+            self.conv_bn(128, 256),
+            self.conv_bn(256, 256),
+            self.conv_bn(256, 256),
+            self.conv_bn(256, 256),
+            self.pool
+        )
+        self.stage4 = nn.Sequential(
+            self.conv_bn(256, 512),
+            self.conv_bn(512, 512),
+            self.conv_bn(512, 512),
+            self.conv_bn(512, 512),
+            self.pool
+        )
+        self.stage5 = nn.Sequential(
+            self.conv_bn(512, 512),
+            self.conv_bn(512, 512),
+            self.conv_bn(512, 512),
+            self.conv_bn(512, 512),
+            self.pool
+        )
+        self.gap = nn.AdaptiveAvgPool2d((1, 1))
+        self.classifier = nn.Linear(512, num_classes)
+
+    def conv_bn(self, inp, oup):
+        return nn.Sequential(
+            nn.Conv2d(inp, oup, kernel_size=self.kernel_size, stride=self.stride, padding=self.padding),
+            nn.BatchNorm2d(oup),
             nn.ReLU()
         )
-        self.fc2= nn.Sequential(
-            nn.Linear(4096, num_classes)
-        )
 
-        self.pool = nn.MaxPool2d(kernel_size = 2, stride = 2)
+    def fuse(self):
+        """
+        Fuses every Conv2d, BatchNorm2d and ReLU triplet into a single ConvReLU2d module, with the BatchNorm folded into the convolution weights.
+
+        Only valid for inference, the model has to be in eval mode.
+        """
+        assert not self.training, "VGG19.fuse() needs the model in eval mode"
+        conv_blocks = [
+            name for name, module in self.named_modules()
+            if isinstance(module, nn.Sequential) and len(module) == 3
+            and isinstance(module[0], nn.Conv2d) and isinstance(module[1], nn.BatchNorm2d)
+        ]
+        if not conv_blocks:
+            return self
+        torch.ao.quantization.fuse_modules(
+            self,
+            [[f"{name}.0", f"{name}.1", f"{name}.2"] for name in conv_blocks],
+            inplace=True
+        )
+        return self
         
+    def checkpoint_stage(self, stage, x):
+        """
+        Runs a stage without storing its activations, they are recomputed in the backward pass.
+
+        The recomputation runs the BatchNorm layers in train mode again, so their running statistics are restored afterwards to count every step once.
+        """
+        first_call = [True]
+
+        def run_stage(x):
+            if first_call[0]:
+                first_call[0] = False
+                return stage(x)
+            buffers = [buffer.clone() for buffer in stage.buffers()]
+            try:
+                return stage(x)
+            finally:
+                # Also runs when the recomputation stops early
+                with torch.no_grad():
+                    for buffer, saved in zip(stage.buffers(), buffers):
+                        buffer.copy_(saved)
+
+        return torch.utils.checkpoint.checkpoint(run_stage, x, use_reentrant=False)
+
     def forward(self, x):
-        x = self.conv_1_1(x)
-        x = self.conv_1_2(x)
-        x = self.pool(x)
-        x = self.conv_2_1(x)
-        x = self.conv_2_2(x)
-        x = self.pool(x)
-        x = self.conv_3_1(x)
-        x = self.conv_3_2(x)
-        x = self.conv_3_3(x)
-        x = self.conv_3_4(x)
-        x = self.pool(x)
-        x = self.conv_4_1(x)
-        x = self.conv_4_2(x)
-        x = self.conv_4_3(x)
-        x = self.conv_4_4(x)
-        x = self.pool(x)
-        x = self.conv_5_1(x)
-        x = self.conv_5_2(x)
-        x = self.conv_5_3(x)
-        x = self.conv_5_4(x)
-        x = self.pool(x)
-        x = x.reshape(x.size(0), -1)
-        x = self.fc(x)
-        x = self.fc1(x)
-        x = self.fc2(x)
+        # The first three stages have the largest activations but are cheap to
+        # recompute, so they are checkpointed while training to save memory
+        if self.checkpoint and self.training and torch.is_grad_enabled():
+            x = self.checkpoint_stage(self.stage1, x)
+            x = self.checkpoint_stage(self.stage2, x)
+            x = self.checkpoint_stage(self.stage3, x)
+        else:
+            x = self.stage1(x)
+            x = self.stage2(x)
+            x = self.stage3(x)
+        x = self.stage4(x)
+        x = self.stage5(x)
+        x = self.gap(x)
+        x = torch.flatten(x, 1)
+        x = self.classifier(x)
         return x
 
 
@@ -178,8 +168,7 @@ class Block(nn.Module):
         x = self.bn2(x)
         if self.identity_downsample is not None:
             identity = self.identity_downsample(identity)
-        x += identity
-        x = self.relu(x)
+        x = self.relu(x + identity)
 
         return x
 
@@ -242,35 +231,35 @@ class ResNet18(nn.Module):
         x = self.layer4(x)
         
         x = self.avgpool(x)
-        x = x.view(x.shape[0], -1)
+        x = torch.flatten(x, 1)
         x = self.fc(x)
         return x 
 
 
 ### MobileNetV3
 
+# Hswish and Hsigmoid are no longer used by the layers below (nn.Hardswish and
+# nn.Hardsigmoid are), they are kept so previously pickled models still load.
 class Hswish(nn.Module):
     def forward(self, x):
-        return x * F.relu6(x + 3, inplace=True) / 6
+        return F.hardswish(x)
 
 class Hsigmoid(nn.Module):
     def forward(self, x):
-        return F.relu6(x + 3, inplace=True) / 6
+        return F.hardsigmoid(x)
 
 class SqueezeExcitation(nn.Module):
     def __init__(self, in_channels, reduced_channels):
         super(SqueezeExcitation, self).__init__()
-        self.se = nn.Sequential(
-            nn.AdaptiveAvgPool2d((1, 1)),
-            nn.Conv2d(in_channels, reduced_channels, kernel_size=1, stride=1, padding=0),
-            Hswish(),
-            nn.Conv2d(reduced_channels, in_channels, kernel_size=1, stride=1, padding=0),
-            Hsigmoid()
-        )
+        # After global pooling the excitation is a plain MLP on the channel vector
+        self.fc1 = nn.Linear(in_channels, reduced_channels)
+        self.fc2 = nn.Linear(reduced_channels, in_channels)
 
     def forward(self, x):
-        se = self.se(x)
-        return x * se
+        se = x.mean(dim=(2, 3))
+        se = self.fc2(F.hardswish(self.fc1(se), inplace=True))
+        se = F.hardsigmoid(se, inplace=True)
+        return x * se.unsqueeze(-1).unsqueeze(-1)
 
 class InvertedResidualBlock(nn.Module):
     def __init__(self, in_channels, out_channels, stride, expansion_factor):
@@ -283,11 +272,11 @@ class InvertedResidualBlock(nn.Module):
         if expansion_factor != 1:
             layers.append(nn.Conv2d(in_channels, hidden_dim, kernel_size=1, stride=1, padding=0, bias=False))
             layers.append(nn.BatchNorm2d(hidden_dim))
-            layers.append(Hswish())
+            layers.append(nn.Hardswish(inplace=True))
 
         layers.append(nn.Conv2d(hidden_dim, hidden_dim, kernel_size=3, stride=stride, padding=1, groups=hidden_dim, bias=False))
         layers.append(nn.BatchNorm2d(hidden_dim))
-        layers.append(Hswish())
+        layers.append(nn.Hardswish(inplace=True))
 
         layers.append(nn.Conv2d(hidden_dim, out_channels, kernel_size=1, stride=1, padding=0, bias=False))
         layers.append(nn.BatchNorm2d(out_channels))
@@ -306,7 +295,7 @@ class MobileNetV3_Stem(nn.Module):
         self.stem = nn.Sequential(
             nn.Conv2d(in_channels, out_channels, kernel_size=3, stride=2, padding=1, bias=False),
             nn.BatchNorm2d(out_channels),
-            Hswish()
+            nn.Hardswish(inplace=True)
         )
 
     def forward(self, x):
@@ -317,7 +306,7 @@ class Classifier(nn.Module):
         super(Classifier, self).__init__()
         self.avgpool = nn.AdaptiveAvgPool2d((1, 1))
         self.conv1 = nn.Conv2d(in_channels, 1280, kernel_size=1, stride=1, padding=0, bias=True)
-        self.hswish1 = Hswish()
+        self.hswish1 = nn.Hardswish(inplace=True)
         self.dropout = nn.Dropout(p=0.2, inplace=True)
         self.conv2 = nn.Conv2d(1280, num_classes, kernel_size=1, stride=1, padding=0, bias=True)
 
@@ -327,22 +316,23 @@ class Classifier(nn.Module):
         x = self.hswish1(x)
         x = self.dropout(x)
         x = self.conv2(x)
-        x = x.view(x.size(0), -1)
+        x = torch.flatten(x, 1)
         return x
 
 class MobileNetV3(nn.Module):
     def __init__(self, num_classes=1000):
         super(MobileNetV3, self).__init__()
         self.stem = MobileNetV3_Stem(3, 16)
+        # Downsample in every other block only, 112 -> 14 after the stem
         self.bottlenecks = nn.Sequential(
-            InvertedResidualBlock(16, 16, 2, 1),
+            InvertedResidualBlock(16, 16, 1, 1),
             InvertedResidualBlock(16, 24, 2, 2),
-            InvertedResidualBlock(24, 40, 2, 2),
+            InvertedResidualBlock(24, 40, 1, 2),
             InvertedResidualBlock(40, 80, 2, 1),
-            InvertedResidualBlock(80, 160, 2, 2),
+            InvertedResidualBlock(80, 160, 1, 2),
             InvertedResidualBlock(160, 320, 2, 1),
-            InvertedResidualBlock(320, 640, 2, 1),
-            InvertedResidualBlock(640, 1280, 2, 1),
+            InvertedResidualBlock(320, 640, 1, 1),
+            InvertedResidualBlock(640, 1280, 1, 1),
         )
         self.classifier = Classifier(1280, num_classes)
 
@@ -466,7 +456,7 @@ class MnasNet(nn.Module):
             nn.BatchNorm2d(1280),
             nn.ReLU6(inplace=True)
         )
-        self.avgpool = nn.AdaptiveAvgPool2d((1))
+        self.avgpool = nn.AdaptiveAvgPool2d((1, 1))
         self.classifier = nn.Linear(1280,num_classes)
 
     def forward(self,x):
@@ -474,7 +464,7 @@ class MnasNet(nn.Module):
         x = self.layers(x)
         x = self.head(x)
         x = self.avgpool(x)
-        x = x.view(-1,x.shape[1])
+        x = torch.flatten(x, 1)
         x = self.classifier(x)
         return x
 
@@ -55,7 +55,7 @@ if __name__ == "__main__":
     image_tensor = image_tensor.unsqueeze(dim=0).to(device)
 
     if model_name == "all":
-        models =[model.split(".")[0] for model in os.listdir("models")]
+        models =[model.split(".")[0] for model in os.listdir("models") if model.endswith(".pth")]
 
     else:
         models = [model_name]
@@ -64,6 +64,10 @@ if __name__ == "__main__":
         model = utils.load_model("models", f"{model_name}.pth")
         classes = model["class_names"]
         model = model["model"].to(device)
+        model.eval()
+        if hasattr(model, "fuse"):
+            model.fuse()
+        model = utils.fuse_conv_bn(model)
         pred = model(image_tensor)
         print(f"\nBy the model {model_name},", "\nThe image is predicted to be : " + classes[pred.argmax(dim=1)] + "\n")
 
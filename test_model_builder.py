@@ -0,0 +1,34 @@
+"""
+Tests for the PyTorch models in model_builder.py.
+"""
+import torch
+
+import model_builder
+
+
+def test_vgg19_checkpoint_counts_batchnorm_once_per_step():
+    torch.manual_seed(42)
+    model = model_builder.VGG19(num_classes=3, checkpoint=True)
+    x = torch.randn(2, 3, 64, 64)
+
+    for step in range(1, 3):
+        model(x).sum().backward()
+        for module in model.modules():
+            if isinstance(module, torch.nn.BatchNorm2d):
+                assert module.num_batches_tracked.item() == step
+
+
+def test_vgg19_checkpoint_matches_eager_training():
+    x = torch.randn(2, 3, 64, 64)
+    torch.manual_seed(42)
+    checkpointed = model_builder.VGG19(num_classes=3, checkpoint=True)
+    torch.manual_seed(42)
+    eager = model_builder.VGG19(num_classes=3, checkpoint=False)
+
+    checkpointed(x).sum().backward()
+    eager(x).sum().backward()
+
+    for (name, a), (_, b) in zip(checkpointed.state_dict().items(), eager.state_dict().items()):
+        assert torch.allclose(a.float(), b.float()), name
+    for a, b in zip(checkpointed.parameters(), eager.parameters()):
+        assert torch.allclose(a.grad, b.grad, atol=1e-6)
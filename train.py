@@ -3,6 +3,7 @@ Trains a PyTorch image classification model using device-agnostic code.
 """
 
 import os
+import importlib.util
 import torch
 
 import data_setup, engine, model_builder, utils
@@ -10,12 +11,36 @@ import argparse
 
 from torchvision import transforms
 
+# Maps the --MODEL argument to the model class and the name it is saved under
+MODELS = {
+    "vgg19": (model_builder.VGG19, "VGG19"),
+    "resnet18": (model_builder.ResNet18, "ResNet18"),
+    "mnasnet": (model_builder.MnasNet, "MnasNet"),
+    "mobilenetv3": (model_builder.MobileNetV3, "MobileNetV3"),
+    "alexnet": (model_builder.AlexNet, "AlexNet"),
+    "shufflenetv2": (model_builder.ShuffleNetV2, "ShuffleNetv2"),
+    "squeezenet": (model_builder.SqueezeNet, "SqueezeNet"),
+    "efficientnet": (model_builder.EfficientNet, "EfficientNet"),
+}
+
 if __name__ == "__main__":
+    # Inputs always have the same 224x224 shape, let cuDNN benchmark and pick the fastest
+    # convolution algorithms, and allow TF32 matmuls and convolutions on Ampere and newer
+    torch.backends.cudnn.benchmark = True
+    torch.backends.cuda.matmul.allow_tf32 = True
+    torch.backends.cudnn.allow_tf32 = True
+    torch.set_float32_matmul_precision("high")
+
     parser = argparse.ArgumentParser()
     parser.add_argument("--MODEL")
     parser.add_argument("--TRAINED", default=False)
     parser.add_argument("--EPOCHS")
     parser.add_argument("--BATCH_SIZE", default=8)
+    parser.add_argument("--CHANNELS_LAST", default="False")
+    parser.add_argument("--AMP", default="False")
+    parser.add_argument("--COMPILE", default="False")
+    parser.add_argument("--CUDA_GRAPHS", default="False")
+    parser.add_argument("--TENSORRT", default="False")
 
     args = parser.parse_args()
 
@@ -38,12 +63,26 @@ if __name__ == "__main__":
     ])
 
 
+    cuda_graphs = True if args.CUDA_GRAPHS == "True" else False if args.CUDA_GRAPHS == "False" else None
+    if cuda_graphs == None:
+        raise Exception("Wrong Argument --CUDA_GRAPHS, \"True\" or \"False\".")
+
+    if cuda_graphs and device != "cuda":
+        print("[INFO] --CUDA_GRAPHS needs a CUDA device, ignoring.")
+        cuda_graphs = False
+
     # Create DataLoaders with help from data_setup.py
     train_dataloader, test_dataloader, class_names = data_setup.create_dataloaders(
         train_dir=train_dir,
         test_dir=test_dir,
         transform=data_transform,
-        batch_size=BATCH_SIZE
+        batch_size=BATCH_SIZE,
+        num_workers=max(1, os.cpu_count() // 2),
+        pin_memory=device == "cuda",
+        persistent_workers=True,
+        prefetch_factor=4,
+        # A captured graph replays a fixed input shape, drop the last partial batch
+        drop_last=cuda_graphs
     )
 
     # Create model with help from model_builder.py
@@ -52,58 +91,13 @@ if __name__ == "__main__":
     torch.cuda.manual_seed(42)
     torch.manual_seed(42)
 
-    if model_name == "vgg19":
-        model = model_builder.VGG19(
-            num_classes=len(class_names)
-        )
-        model_name = "VGG19"
-
-    elif model_name == "resnet18":
-        model = model_builder.ResNet18(
-            num_classes=len(class_names)
-        )
-        model_name = "ResNet18"
-
-    elif model_name == "mnasnet":
-        model = model_builder.MnasNet(
-            num_classes=len(class_names)
-        )
-        model_name = "MnasNet"
-    
-    elif model_name == "mobilenetv3":
-        model = model_builder.MobileNetV3(
-            num_classes=len(class_names)
-        )
-        model_name = "MobileNetV3"
-
-    elif model_name == "alexnet":
-        model = model_builder.AlexNet(
-            num_classes=len(class_names)
-        )
-        model_name = "AlexNet"
-
-    elif model_name == "shufflenetv2":
-        model = model_builder.ShuffleNetV2(
-            num_classes=len(class_names)
-        )
-        model_name = "ShuffleNetv2"
-
-    
-    elif model_name == "squeezenet":
-        model = model_builder.ShuffleNetV2(
-            num_classes=len(class_names)
-        )
-        model_name = "SqueezeNet"
-
-    
-    elif model_name == "efficientnet":
-        model = model_builder.EfficientNet(
-            num_classes=len(class_names)
-        )
-        model_name = "EfficientNet"
-
-    else :
+    if model_name not in MODELS:
         raise Exception("Wrong Model.")
+
+    model_class, model_name = MODELS[model_name]
+    model = model_class(
+        num_classes=len(class_names)
+    )
     
 
 
@@ -116,10 +110,69 @@ if __name__ == "__main__":
         model_data = utils.load_model(file_dir = "models", model_name = f"{model_name}.pth")
         model = model_data["model"]
     
-    # Set loss and optimizer
+    channels_last = True if args.CHANNELS_LAST == "True" else False if args.CHANNELS_LAST == "False" else None
+    if channels_last == None:
+        raise Exception("Wrong Argument --CHANNELS_LAST, \"True\" or \"False\".")
+
+    # channels_last only pays off on Tensor Core GPUs (Volta and newer)
+    if channels_last and not (device == "cuda" and torch.cuda.get_device_capability()[0] >= 7):
+        print("[INFO] --CHANNELS_LAST needs a CUDA device with compute capability >= 7.0, ignoring.")
+        channels_last = False
+
+    amp = True if args.AMP == "True" else False if args.AMP == "False" else None
+    if amp == None:
+        raise Exception("Wrong Argument --AMP, \"True\" or \"False\".")
+
+    # Mixed precision runs the forward pass in BF16 (Ampere and newer) or FP16 on CUDA devices only
+    if amp and device != "cuda":
+        print("[INFO] --AMP needs a CUDA device, ignoring.")
+        amp = False
+    amp_dtype = None
+    if amp:
+        # is_bf16_supported() also reports emulated BF16 on Volta/Turing, which has no Tensor Core path
+        amp_dtype = torch.bfloat16 if torch.cuda.get_device_capability()[0] >= 8 else torch.float16
+
+    compile_model = True if args.COMPILE == "True" else False if args.COMPILE == "False" else None
+    if compile_model == None:
+        raise Exception("Wrong Argument --COMPILE, \"True\" or \"False\".")
+
+    if compile_model and not hasattr(torch, "compile"):
+        print("[INFO] --COMPILE needs PyTorch 2.0 or newer, ignoring.")
+        compile_model = False
+
+    if cuda_graphs and compile_model:
+        print("[INFO] --COMPILE already captures CUDA graphs, ignoring --CUDA_GRAPHS.")
+        cuda_graphs = False
+
+    tensorrt = True if args.TENSORRT == "True" else False if args.TENSORRT == "False" else None
+    if tensorrt == None:
+        raise Exception("Wrong Argument --TENSORRT, \"True\" or \"False\".")
+
+    if tensorrt and device != "cuda":
+        print("[INFO] --TENSORRT needs a CUDA device, ignoring.")
+        tensorrt = False
+    elif tensorrt and importlib.util.find_spec("torch_tensorrt") is None:
+        print("[INFO] --TENSORRT needs the torch_tensorrt package, ignoring.")
+        tensorrt = False
+
+    # Send model to target device, fused optimizers need the parameters there
+    model.to(device)
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+
+    # Set loss and optimizer, the fused Adam updates all parameters in a single kernel
     loss_fn = torch.nn.CrossEntropyLoss()
-    optimizer = torch.optim.Adam(model.parameters(),
-                                lr=LEARNING_RATE)
+    try:
+        optimizer = torch.optim.Adam(model.parameters(),
+                                    lr=LEARNING_RATE,
+                                    fused=device == "cuda")
+    except (TypeError, RuntimeError):
+        # fused is not supported by this PyTorch version, use the multi-tensor implementation
+        optimizer = torch.optim.Adam(model.parameters(),
+                                    lr=LEARNING_RATE,
+                                    foreach=True)
+    # BF16 has the FP32 exponent range, loss scaling is only needed for FP16
+    scaler = torch.amp.GradScaler("cuda", enabled=amp_dtype == torch.float16)
 
     # Load previous training data if available
     if trained:
@@ -127,8 +180,29 @@ if __name__ == "__main__":
     else:
         prev_res = None
 
+    # torch.compile wraps the model, keep the eager module around for saving
+    trained_model = model
+    if compile_model:
+        model = torch.compile(model, mode="reduce-overhead", fullgraph=False)
+
+    # Capture the training forward and backward passes once, then replay them
+    # with a single graph launch per step. Eval mode still runs eagerly.
+    if cuda_graphs:
+        # The graph only replays in the mode it was captured in, and models
+        # reloaded with --TRAINED True were saved in eval mode
+        model.train()
+        sample = torch.zeros(BATCH_SIZE, 3, 224, 224, device=device)
+        if channels_last:
+            sample = sample.contiguous(memory_format=torch.channels_last)
+        # Warmup iterations run on the zero sample, keep the BatchNorm statistics untouched
+        buffers = {name: buffer.clone() for name, buffer in model.named_buffers()}
+        with torch.autocast(device_type="cuda", dtype=amp_dtype, enabled=amp_dtype is not None, cache_enabled=False):
+            model = torch.cuda.make_graphed_callables(model, (sample,))
+        with torch.no_grad():
+            for name, buffer in model.named_buffers():
+                buffer.copy_(buffers[name])
+
     # Start training with help from engine.py
-    model.to(device)
     results = engine.train(model=model,
                 train_dataloader=train_dataloader,
                 test_dataloader=test_dataloader,
@@ -136,14 +210,28 @@ if __name__ == "__main__":
                 optimizer=optimizer,
                 epochs=NUM_EPOCHS,
                 device=device,
-                results=prev_res)
+                results=prev_res,
+                channels_last=channels_last,
+                amp_dtype=amp_dtype,
+                scaler=scaler)
+
+    # The graphed forward is an instance attribute that can't be pickled,
+    # drop it so the class forward is saved instead
+    if cuda_graphs:
+        del trained_model.forward
 
     # Save the model with help from utils.py
-    utils.save_model(model=model,
+    utils.save_model(model=trained_model,
                     target_dir="models",
                     model_name=f"{model_name}.pth",
                     class_names=class_names)
 
+    # Export the model for TensorRT inference with the help from utils.py
+    if tensorrt:
+        utils.export_tensorrt(model=trained_model,
+                        target_dir="models",
+                        model_name=f"{model_name}.ep")
+
     # Save the training data with the help from utils.py
     utils.save_data(
         model_name,
@@ -4,6 +4,8 @@ Contains various utility functions for PyTorch model training, saving and loadin
 pritam das
 """
 import torch
+from torch import nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 from pathlib import Path
 import os
 import csv
@@ -79,6 +81,75 @@ def load_model(
     model = torch.load(model_load_path)
     return model
 
+def export_tensorrt(
+    model: torch.nn.Module,
+    target_dir: str,
+    model_name: str
+):
+    """Compiles a PyTorch model with Torch-TensorRT and saves it to a target directory.
+
+    Requires a CUDA device and the optional torch_tensorrt package. The engine
+    is built for FP16 and 1 x 3 x 224 x 224 inputs.
+
+    Args:
+        model: A target PyTorch model to export.
+        target_dir: A directory for saving the exported model to.
+        model_name: A filename for the exported model. Should include
+            ".ep" as the file extension.
+
+    Example usage:
+        export_tensorrt(model=model_0,
+                    target_dir="models",
+                    model_name="modular_tingvgg_model.ep")
+    """
+    import torch_tensorrt
+
+    # Create target directory
+    target_dir_path = Path(target_dir)
+    target_dir_path.mkdir(parents=True,
+                        exist_ok=True)
+
+    # Create model export path
+    assert model_name.endswith(".ep"), "model_name should end with '.ep'"
+    model_export_path = target_dir_path / model_name
+
+    # Compile and save the TensorRT program
+    print(f"\n[INFO] Exporting TensorRT model to: {model_export_path}")
+    example = torch.randn(1, 3, 224, 224).cuda()
+    trt_gm = torch_tensorrt.compile(
+        model.eval().cuda(),
+        ir="dynamo",
+        inputs=[example],
+        enabled_precisions={torch.float16}
+    )
+    torch_tensorrt.save(trt_gm, str(model_export_path), inputs=[example])
+
+def fuse_conv_bn(
+    model: torch.nn.Module
+) -> torch.nn.Module:
+    """
+    Folds every BatchNorm2d into the Conv2d registered right before it.
+
+    The BatchNorm statistics and affine parameters are baked into the convolution
+    weight and bias, and the BatchNorm is replaced by nn.Identity, so no BatchNorm
+    kernel runs at inference. The model is put in eval mode and modified in place,
+    it should not be trained afterwards.
+
+    Args:
+        model: A target PyTorch model to fuse.
+
+    Example usage:
+        model = fuse_conv_bn(model=model_0)
+    """
+    model.eval()
+    for module in list(model.modules()):
+        children = list(module.named_children())
+        for (conv_name, conv), (bn_name, bn) in zip(children, children[1:]):
+            if type(conv) is nn.Conv2d and type(bn) is nn.BatchNorm2d:
+                setattr(module, conv_name, fuse_conv_bn_eval(conv, bn))
+                setattr(module, bn_name, nn.Identity())
+    return model
+
 def save_data(
     model_name: str,
     data: Dict